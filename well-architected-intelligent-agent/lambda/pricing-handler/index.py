@@ -1,12 +1,31 @@
+import base64
 import boto3
+import codecs
+import gzip
+import hashlib
+import io
 import json
 import re
-import uuid
+import statistics
+import threading
 import os
 import time
 import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from urllib.parse import unquote_plus
+from uuid import uuid4
+
+# orjson parses the Price List API documents much faster; fall back to the stdlib if it isn't packaged
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configure logging
 logger = logging.getLogger()
@@ -15,27 +34,201 @@ logger.setLevel(logging.INFO)
 # Configuration parameters
 OUTPUT_BUCKET = os.environ.get('OUTPUT_BUCKET', 'my-output-bucket')
 OUTPUT_PREFIX = os.environ.get('OUTPUT_PREFIX', '')  # New parameter for prefix
+PRETTY_OUTPUT = os.environ.get('PRETTY_OUTPUT', 'false').lower() == 'true'  # Indent stored JSON for readability
+COMPRESS_OUTPUT = os.environ.get('COMPRESS_OUTPUT', 'true').lower() == 'true'  # Gzip stored JSON
+OUTPUT_COMPRESS_LEVEL = int(os.environ.get('OUTPUT_COMPRESS_LEVEL', '1'))  # Gzip level; JSON gets most of its size win at level 1
+MULTIPART_THRESHOLD = 8 * 1024 * 1024  # Output size in bytes above which S3 uploads use multipart
+ASYNC_OUTPUT_UPLOAD = os.environ.get('ASYNC_OUTPUT_UPLOAD', 'false').lower() == 'true'  # Return before the S3 upload finishes
 BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-v2.1')
 MAX_RETRIES = int(os.environ.get('MAX_RETRIES', '3'))
 RETRY_DELAY = int(os.environ.get('RETRY_DELAY', '2'))
+CACHE_RETRY_DELAY = 0.05  # Seconds before retrying unprocessed pricing cache keys; doubles per attempt
 PRICING_CACHE_TTL = int(os.environ.get('PRICING_CACHE_TTL', '86400'))  # 24 hours in seconds
+PRICING_MEMORY_CACHE_SIZE = int(os.environ.get('PRICING_MEMORY_CACHE_SIZE', '1024'))  # Entries kept per container
+PRICING_MAX_WORKERS = int(os.environ.get('PRICING_MAX_WORKERS', '16'))  # Concurrent Price List lookups on cache misses
+BEDROCK_RESPONSE_CACHE_SIZE = int(os.environ.get('BEDROCK_RESPONSE_CACHE_SIZE', '128'))  # Responses kept per container; 0 disables
+BEDROCK_RESPONSE_CACHE_TTL = int(os.environ.get('BEDROCK_RESPONSE_CACHE_TTL', '3600'))  # 1 hour in seconds
+MAX_TOKENS_CEILINGS = {'analysis': 1500, 'recommendations': 2000}  # Fixed max_tokens per prompt kind
+ADAPTIVE_MAX_TOKENS_MIN_SAMPLES = 20  # Completions observed before max_tokens is lowered from its ceiling
+ADAPTIVE_MAX_TOKENS_FLOOR = 400  # Never size max_tokens below this
+DAX_ENDPOINT = os.environ.get('DAX_ENDPOINT', '')  # Optional DAX cluster endpoint for the pricing cache
+TEXTRACT_POLL_INITIAL_DELAY = 0.5  # Seconds before the first Textract job status check
+TEXTRACT_POLL_MAX_DELAY = 5.0  # Upper bound on the Textract polling interval
+RESOURCE_CONFIG_WINDOW = 200  # Characters searched on either side of a service mention
+
+# Shared client settings: a pool large enough for the concurrent pricing lookups, kept-alive
+# connections, and adaptive retries that back off on throttling
+CLIENT_CONFIG = Config(
+    max_pool_connections=max(32, PRICING_MAX_WORKERS),
+    retries={'max_attempts': MAX_RETRIES, 'mode': 'adaptive'},
+    tcp_keepalive=True
+)
+
+# AWS clients are created on first use so cold starts only pay for the services a request touches.
+# Creating clients from boto3's default session isn't thread-safe, and pricing lookups and resource
+# checks can ask for clients from worker threads, so creation is serialized.
+_client_lock = threading.Lock()
+
+def get_client(service_name):
+    """
+    Return a cached boto3 client for the given service
+    """
+    with _client_lock:
+        return _create_client(service_name)
+
+@lru_cache(maxsize=None)
+def _create_client(service_name):
+    """
+    Create the boto3 client for a service; only called with _client_lock held
+    """
+    return boto3.client(service_name, config=CLIENT_CONFIG)
 
-# Initialize AWS clients
-textract = boto3.client('textract')
-bedrock = boto3.client('bedrock-runtime')
-s3 = boto3.client('s3')
-pricing = boto3.client('pricing')
-dynamodb = boto3.resource('dynamodb')
+# Resources verified by this container; warm invocations reuse them instead of probing AWS again
+_resources_checked = False
+_pricing_cache_table_name = None
+_output_bucket_verified = False
 
-# Initialize the pricing cache table
+# In-memory pricing cache in front of DynamoDB: cache_key -> (stored_at, pricing_data), oldest first
+_pricing_memory_cache = OrderedDict()
+_pricing_memory_lock = threading.Lock()
+
+# Bedrock responses keyed on a digest of the request body: digest -> (stored_at, text), oldest first
+_bedrock_response_cache = OrderedDict()
+_bedrock_response_lock = threading.Lock()
+
+# Recent completion lengths per prompt kind, used to size max_tokens
+_completion_tokens = {}
+
+# Background S3 uploads, only used when the caller doesn't need the output to be durable on return
+_upload_executor = ThreadPoolExecutor(max_workers=2) if ASYNC_OUTPUT_UPLOAD else None
+_pending_uploads = []
+_transfer_config = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, max_concurrency=8, use_threads=True)
+
+# AWS service names detected in the analysis text
+SERVICE_NAMES = (
+    'EC2', 'S3', 'RDS', 'Lambda', 'DynamoDB', 'ECS', 'EKS', 'SQS', 'SNS', 'CloudFront',
+    'API Gateway', 'Route53', 'CloudWatch', 'IAM', 'VPC', 'ELB', 'ALB', 'NLB', 'CloudFormation',
+    'Step Functions', 'Kinesis', 'Glue', 'Athena', 'EMR', 'Redshift', 'ElastiCache', 'Neptune',
+    'DocumentDB', 'MSK', 'OpenSearch', 'Elasticsearch', 'CodePipeline', 'CodeBuild', 'CodeDeploy',
+    'CodeCommit', 'Amplify', 'AppSync', 'EventBridge', 'CloudTrail', 'GuardDuty', 'WAF', 'Shield',
+    'Secrets Manager', 'KMS', 'ACM', 'Cognito', 'SES', 'Pinpoint'
+)
+
+# Enhanced regex for AWS service detection, compiled once per container
+SERVICE_REGEX = r'\b(' + '|'.join(re.escape(name) for name in SERVICE_NAMES) + r')\b'
+SERVICE_PATTERN = re.compile(SERVICE_REGEX, re.IGNORECASE)
+
+# With pyahocorasick packaged, scan for all service names in a single pass instead of a regex alternation
 try:
-    pricing_cache_table = ensure_pricing_cache_table_exists()
-except Exception as e:
-    logger.warning(f"Could not initialize pricing cache table: {str(e)}")
-    pricing_cache_table = None
+    import ahocorasick
+    SERVICE_AUTOMATON = ahocorasick.Automaton()
+    for name in SERVICE_NAMES:
+        SERVICE_AUTOMATON.add_word(name.lower(), name.lower())
+    SERVICE_AUTOMATON.make_automaton()
+except ImportError:
+    SERVICE_AUTOMATON = None
+
+# Product attributes that are relevant to cost estimates and recommendations
+COST_ATTRIBUTE_KEYS = ['instanceType', 'vcpu', 'memory', 'storageClass', 'volumeType', 'databaseEngine']
+
+# Assumptions and disclaimers attached to every cost estimate
+GENERAL_COST_ASSUMPTIONS = (
+    "All services run 24/7 unless otherwise specified",
+    "Data transfer costs not included",
+    "Free tier benefits not applied",
+    "On-demand pricing used (no reserved instances or savings plans)"
+)
+
+COST_DISCLAIMERS = (
+    "This cost estimate is approximate and for informational purposes only.",
+    "Actual AWS billing may vary based on usage patterns, data transfer, request patterns, and other factors.",
+    "This estimate doesn't account for AWS Free Tier benefits, which may reduce actual costs.",
+    "Prices are based on current public AWS pricing and may change over time.",
+    "For a more accurate estimate, use the AWS Pricing Calculator or contact AWS."
+)
 
-# Enhanced regex for AWS service detection
-SERVICE_REGEX = r'\b(EC2|S3|RDS|Lambda|DynamoDB|ECS|EKS|SQS|SNS|CloudFront|API Gateway|Route53|CloudWatch|IAM|VPC|ELB|ALB|NLB|CloudFormation|Step Functions|Kinesis|Glue|Athena|EMR|Redshift|ElastiCache|Neptune|DocumentDB|MSK|OpenSearch|Elasticsearch|CodePipeline|CodeBuild|CodeDeploy|CodeCommit|Amplify|AppSync|EventBridge|CloudTrail|GuardDuty|WAF|Shield|Secrets Manager|KMS|ACM|Cognito|SES|Pinpoint)\b'
+# Static prompt instructions, kept separate from per-request data
+ANALYSIS_INSTRUCTIONS = """Analyze the infrastructure description that follows and extract the following information:
+1. AWS services mentioned
+2. Resource types and configurations (include instance types, storage sizes, etc.)
+3. Architecture patterns and relationships between services
+4. Potential cost drivers and high-cost components
+5. Security considerations
+
+Please format your response in clear sections for each category. Be specific about resource configurations when they are mentioned."""
+
+RECOMMENDATIONS_INSTRUCTIONS = """Based on the infrastructure analysis, pricing information, and cost estimates that follow, 
+provide detailed optimization recommendations to improve cost efficiency, performance, security, and reliability.
+
+Please provide specific, actionable recommendations in these categories:
+1. Cost optimization - Include specific instance right-sizing, reserved instances, savings plans, and storage optimizations
+2. Performance improvements - Suggest architecture changes to improve performance
+3. Security enhancements - Identify potential security issues and recommend solutions
+4. Reliability and high availability - Recommend changes to improve system reliability
+5. Architecture best practices - Suggest AWS Well-Architected Framework improvements
+
+For each recommendation, explain:
+- The specific issue or opportunity
+- The recommended change with specific AWS services or configurations
+- The expected benefit (quantify if possible)
+- Implementation approach and complexity (low, medium, high)
+
+Include a section at the beginning with a summary of the estimated monthly cost and key cost-saving opportunities."""
+
+# Prompt blocks shared by every request; they are only ever serialized, never mutated.
+# No cache_control: the instructions are far below Bedrock's minimum cacheable prefix (1024+ tokens),
+# and the default model doesn't support prompt caching at all.
+BEDROCK_ANTHROPIC_VERSION = "bedrock-2023-05-31"
+ANALYSIS_INSTRUCTIONS_BLOCK = {"type": "text", "text": ANALYSIS_INSTRUCTIONS}
+RECOMMENDATIONS_INSTRUCTIONS_BLOCK = {"type": "text", "text": RECOMMENDATIONS_INSTRUCTIONS}
+
+# Character budget for the data part of the recommendations prompt (roughly 4 characters per token)
+RECOMMENDATIONS_CHAR_BUDGET = int(os.environ.get('RECOMMENDATIONS_CHAR_BUDGET', '24000'))
+TRUNCATION_MARKER = "\n...[truncated]"
+
+# Templates for the per-request part of each prompt, filled with str.format_map
+ANALYSIS_DATA_TEMPLATE = """Infrastructure description:
+{infrastructure_text}"""
+
+RECOMMENDATIONS_DATA_TEMPLATE = """Infrastructure Analysis:
+{analysis}
+
+{pricing_summary}
+
+{cost_summary}"""
+
+# Default usage estimates
+DEFAULT_USAGE_ESTIMATES = {
+    "ec2": {"count": 1, "hours": 730},
+    "rds": {"count": 1, "hours": 730, "size_gb": 20},
+    "s3": {"size_gb": 100, "requests": 100000},
+    "lambda": {"invocations": 1000000, "avg_duration_ms": 500, "memory_mb": 128},
+    "dynamodb": {"size_gb": 10, "rcu": 5, "wcu": 5, "requests": 300000},
+    "cloudfront": {"data_gb": 100, "requests": 1000000},
+    "eks": {"clusters": 1, "nodes": 3},
+    "ecs": {"tasks": 3},
+    "sqs": {"requests": 1000000},
+    "sns": {"requests": 1000000},
+    "cloudwatch": {"metrics": 10, "logs_gb": 5},
+}
+
+# Usage patterns used by estimate_service_usage, compiled once per container
+USAGE_COUNT_PATTERNS = {
+    service: re.compile(rf'(\d+)\s+{service}\s+instances?', re.IGNORECASE)
+    for service in ('ec2', 'rds', 'elasticache')
+}
+STORAGE_UNIT_GB = {'GB': 1, 'TB': 1000, 'PB': 1000000}
+S3_SIZE_PATTERN = re.compile(r'(\d+)\s*(GB|TB|PB)\s+(?:of\s+)?(?:S3|storage)', re.IGNORECASE)
+LAMBDA_INVOCATIONS_PATTERN = re.compile(r'(\d+)\s+(?:lambda\s+)?invocations', re.IGNORECASE)
+LAMBDA_MEMORY_PATTERN = re.compile(r'lambda.*?(\d+)\s*MB', re.IGNORECASE)
+
+# S3 storage class keywords, checked in order, and the Price List storageClass they map to
+S3_STORAGE_CLASSES = (
+    ('intelligent', 'Intelligent-Tiering'),
+    ('infrequent', 'Standard - Infrequent Access'),
+    ('glacier', 'Glacier'),
+    ('deep archive', 'Glacier Deep Archive')
+)
 
 # Expanded service mapping
 SERVICE_MAPPING = {
@@ -95,8 +288,16 @@ def lambda_handler(event, context):
     Main Lambda handler function that processes S3 events
     """
     try:
-        # Ensure required resources exist
-        ensure_output_bucket_exists()
+        # Finish any background uploads left over from earlier invocations
+        wait_for_pending_uploads()
+        
+        # Ensure required resources exist, checking them in the background on cold start while the
+        # document is read and analyzed; nothing needs them before the pricing step
+        resources_ready = None
+        if not _resources_checked:
+            resource_executor = ThreadPoolExecutor(max_workers=1)
+            resources_ready = resource_executor.submit(ensure_resources_exist)
+            resource_executor.shutdown(wait=False)
         
         # Extract S3 information from the event
         s3_bucket, s3_key = extract_s3_info(event)
@@ -107,27 +308,24 @@ def lambda_handler(event, context):
         
         # Step 2: Analyze infrastructure
         analysis_prompt = build_analysis_prompt(infrastructure_text) 
-        analysis_result = query_bedrock_with_retry(analysis_prompt)
+        analysis_result = query_bedrock_with_retry(analysis_prompt, kind='analysis')
         
         # Step 3: Identify services
         services = get_services_from_analysis(analysis_result)
         logger.info(f"Identified services: {services}")
         
+        if resources_ready:
+            resources_ready.result()
+        
         # Step 4: Get pricing information
-        pricing_data = {}
-        for service in services:
-            service_code = map_service_to_code(service)
-            if service_code:
-                resource_config = get_resource_config(service, analysis_result)
-                filters = build_pricing_filters(service_code, resource_config)
-                pricing_data[service] = get_pricing_with_cache(filters)
+        pricing_data = get_pricing_for_services(services, analysis_result)
         
         # Step 5: Generate cost estimation
         cost_estimate = estimate_total_costs(pricing_data, analysis_result)
         
         # Step 6: Generate recommendations with cost information
         recommendations_prompt = build_recommendations_prompt(analysis_result, pricing_data, cost_estimate)
-        recommendations = query_bedrock_with_retry(recommendations_prompt)
+        recommendations = query_bedrock_with_retry(recommendations_prompt, kind='recommendations')
         
         # Step 7: Store output
         output = {
@@ -150,7 +348,7 @@ def lambda_handler(event, context):
             })
         }
     except Exception as e:
-        logger.error(f"Error processing document: {str(e)}", exc_info=True)
+        logger.exception(f"Error processing document: {str(e)}")
         return {
             "statusCode": 500,
             "body": json.dumps({
@@ -191,6 +389,7 @@ def extract_text_with_textract(s3_bucket, s3_key):
     """
     Extract text from image or PDF using Textract with pagination support
     """
+    textract = get_client('textract')
     try:
         # Start document text detection for multi-page documents
         if s3_key.lower().endswith('.pdf'):
@@ -199,30 +398,31 @@ def extract_text_with_textract(s3_bucket, s3_key):
             )
             job_id = response['JobId']
             
-            # Wait for the job to complete
+            # Wait for the job to complete, backing off so short documents aren't held up by a fixed sleep
             status = 'IN_PROGRESS'
+            delay = TEXTRACT_POLL_INITIAL_DELAY
             while status == 'IN_PROGRESS':
-                time.sleep(5)
-                response = textract.get_document_text_detection(JobId=job_id)
+                time.sleep(delay)
+                delay = min(delay * 1.6, TEXTRACT_POLL_MAX_DELAY)
+                # Only the status is needed while polling, so keep the response small
+                response = textract.get_document_text_detection(JobId=job_id, MaxResults=1)
                 status = response['JobStatus']
                 
             if status != 'SUCCEEDED':
                 raise Exception(f"Textract job failed with status: {status}")
                 
-            # Get all pages
+            # Get all pages, using the largest page size to cut round-trips
             pages = []
-            next_token = None
+            request = {'JobId': job_id, 'MaxResults': 1000}
+            get_detection = textract.get_document_text_detection
             
             while True:
-                if next_token:
-                    response = textract.get_document_text_detection(JobId=job_id, NextToken=next_token)
-                else:
-                    response = textract.get_document_text_detection(JobId=job_id)
+                response = get_detection(**request)
                 
                 pages.extend(response['Blocks'])
                 
                 if 'NextToken' in response:
-                    next_token = response['NextToken']
+                    request['NextToken'] = response['NextToken']
                 else:
                     break
                     
@@ -234,7 +434,7 @@ def extract_text_with_textract(s3_bucket, s3_key):
             )
             return get_text_from_textract_blocks(response['Blocks'])
     except Exception as e:
-        logger.error(f"Error in Textract processing: {str(e)}", exc_info=True)
+        logger.exception(f"Error in Textract processing: {str(e)}")
         raise
 
 def extract_text_from_file(s3_bucket, s3_key):
@@ -242,32 +442,33 @@ def extract_text_from_file(s3_bucket, s3_key):
     Extract text from a text file in S3
     """
     try:
-        obj = s3.get_object(Bucket=s3_bucket, Key=s3_key)
+        obj = get_client('s3').get_object(Bucket=s3_bucket, Key=s3_key)
         content = obj['Body'].read()
         
-        # Try different encodings
-        encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
-        for encoding in encodings:
-            try:
-                return content.decode(encoding)
-            except UnicodeDecodeError:
-                continue
-                
-        # If all encodings fail, use latin-1 as a fallback
-        return content.decode('latin-1', errors='replace')
+        # Honour a byte order mark if there is one
+        if content.startswith(codecs.BOM_UTF8):
+            return content.decode('utf-8-sig', errors='replace')
+        if content.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return content.decode('utf-16', errors='replace')
+        
+        # Otherwise decode as UTF-8 once; latin-1 maps every byte, so it can't fail as the fallback
+        try:
+            return content.decode('utf-8')
+        except UnicodeDecodeError:
+            return content.decode('latin-1')
     except Exception as e:
-        logger.error(f"Error reading file: {str(e)}", exc_info=True)
+        logger.exception(f"Error reading file: {str(e)}")
         raise
 
 def get_text_from_textract_blocks(blocks):
     """
     Extract text from Textract blocks
     """
-    text = ""
-    for block in blocks:
-        if block['BlockType'] == 'LINE':
-            text += block['Text'] + " "
-    return text
+    # Join once instead of growing the string line by line
+    return " ".join(
+        text for block in blocks
+        if block.get('BlockType') == 'LINE' and (text := block.get('Text'))
+    )
 
 def build_analysis_prompt(infrastructure_text):
     """
@@ -279,22 +480,18 @@ def build_analysis_prompt(infrastructure_text):
         infrastructure_text = infrastructure_text[:max_text_length] + "..."
     
     prompt = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 1500,
+        "anthropic_version": BEDROCK_ANTHROPIC_VERSION,
+        "max_tokens": adaptive_max_tokens('analysis'),
         "messages": [
             {
                 "role": "user",
-                "content": f"""Analyze this infrastructure description and extract the following information:
-1. AWS services mentioned
-2. Resource types and configurations (include instance types, storage sizes, etc.)
-3. Architecture patterns and relationships between services
-4. Potential cost drivers and high-cost components
-5. Security considerations
-
-Infrastructure description:
-{infrastructure_text}
-
-Please format your response in clear sections for each category. Be specific about resource configurations when they are mentioned."""
+                "content": [
+                    ANALYSIS_INSTRUCTIONS_BLOCK,
+                    {
+                        "type": "text",
+                        "text": ANALYSIS_DATA_TEMPLATE.format_map({"infrastructure_text": infrastructure_text})
+                    }
+                ]
             }
         ]
     }
@@ -316,51 +513,43 @@ def estimate_total_costs(pricing_data, analysis_result):
         service_cost = 0.0
         service_assumptions = []
         
-        if isinstance(prices, list) and prices:
-            # Get the first pricing option as default
-            price_option = prices[0]
-            
-            # Extract usage estimates from the analysis
-            usage_estimate = estimate_service_usage(service, analysis_result)
-            
-            # Get the price information
-            if 'pricing' in price_option and 'onDemand' in price_option['pricing']:
-                on_demand = price_option['pricing']['onDemand']
-                unit_price_str = on_demand.get('pricePerUnit', {}).get('USD', '0')
+        # get_pricing only ever produces plain lists (results) or dicts (errors)
+        if type(prices) is list and prices:
+            # Price the same option the pricing summary shows
+            selected = select_price_option(prices)
+            if selected is None:
+                service_assumptions.append("Could not calculate price - using placeholder")
+            else:
+                price_option, on_demand, unit_price = selected
                 
-                try:
-                    # Convert price string to float
-                    unit_price = float(unit_price_str)
-                    unit_type = on_demand.get('unit', 'unit')
-                    
-                    # Calculate monthly cost based on unit type and usage estimate
-                    if unit_type.lower() == 'hrs' or unit_type.lower() == 'hour':
-                        # Hourly pricing - assume 730 hours per month
-                        monthly_hours = 730 * usage_estimate.get('count', 1)
-                        service_cost = unit_price * monthly_hours
-                        service_assumptions.append(f"Running for 730 hours per month (24/7)")
-                    elif 'gb-mo' in unit_type.lower():
-                        # GB-month pricing
-                        service_cost = unit_price * usage_estimate.get('size_gb', 1)
-                        service_assumptions.append(f"Storage size of {usage_estimate.get('size_gb', 1)} GB")
-                    elif 'requests' in unit_type.lower():
-                        # Per-request pricing
-                        monthly_requests = usage_estimate.get('requests', 100000)
-                        service_cost = unit_price * monthly_requests / 1000  # Usually priced per 1000 requests
-                        service_assumptions.append(f"Approximately {monthly_requests} requests per month")
-                    else:
-                        # Default calculation
-                        service_cost = unit_price * usage_estimate.get('count', 1)
-                        service_assumptions.append(f"Using {usage_estimate.get('count', 1)} units")
-                    
-                    # Add service attributes to assumptions
-                    for key, value in price_option.get('attributes', {}).items():
-                        if key in ['instanceType', 'vcpu', 'memory', 'storageClass', 'volumeType', 'databaseEngine']:
-                            service_assumptions.append(f"{key}: {value}")
+                # Extract usage estimates from the analysis
+                usage_estimate = estimate_service_usage(service, analysis_result)
+                unit_type = (on_demand.get('unit') or 'unit').lower()
+                
+                # Calculate monthly cost based on unit type and usage estimate
+                if unit_type == 'hrs' or unit_type == 'hour':
+                    # Hourly pricing - assume 730 hours per month
+                    monthly_hours = 730 * usage_estimate.get('count', 1)
+                    service_cost = unit_price * monthly_hours
+                    service_assumptions.append(f"Running for 730 hours per month (24/7)")
+                elif 'gb-mo' in unit_type:
+                    # GB-month pricing
+                    service_cost = unit_price * usage_estimate.get('size_gb', 1)
+                    service_assumptions.append(f"Storage size of {usage_estimate.get('size_gb', 1)} GB")
+                elif 'requests' in unit_type:
+                    # Per-request pricing
+                    monthly_requests = usage_estimate.get('requests', 100000)
+                    service_cost = unit_price * monthly_requests / 1000  # Usually priced per 1000 requests
+                    service_assumptions.append(f"Approximately {monthly_requests} requests per month")
+                else:
+                    # Default calculation
+                    service_cost = unit_price * usage_estimate.get('count', 1)
+                    service_assumptions.append(f"Using {usage_estimate.get('count', 1)} units")
                 
-                except (ValueError, TypeError):
-                    service_cost = 0.0
-                    service_assumptions.append("Could not calculate price - using placeholder")
+                # Add service attributes to assumptions
+                for key, value in (price_option.get('attributes') or {}).items():
+                    if key in COST_ATTRIBUTE_KEYS:
+                        service_assumptions.append(f"{key}: {value}")
         
         # Add to total cost
         total_estimated_cost += service_cost
@@ -371,26 +560,13 @@ def estimate_total_costs(pricing_data, analysis_result):
         assumptions.extend(service_assumptions)
     
     # Add general assumptions
-    general_assumptions = [
-        "All services run 24/7 unless otherwise specified",
-        "Data transfer costs not included",
-        "Free tier benefits not applied",
-        "On-demand pricing used (no reserved instances or savings plans)"
-    ]
-    
-    disclaimers = [
-        "This cost estimate is approximate and for informational purposes only.",
-        "Actual AWS billing may vary based on usage patterns, data transfer, request patterns, and other factors.",
-        "This estimate doesn't account for AWS Free Tier benefits, which may reduce actual costs.",
-        "Prices are based on current public AWS pricing and may change over time.",
-        "For a more accurate estimate, use the AWS Pricing Calculator or contact AWS."
-    ]
+    assumptions.extend(GENERAL_COST_ASSUMPTIONS)
     
     return {
         "total_estimated_monthly_cost": round(total_estimated_cost, 2),
         "service_costs": service_costs,
-        "assumptions": list(set(assumptions + general_assumptions)),  # Remove duplicates
-        "disclaimers": disclaimers
+        "assumptions": list(dict.fromkeys(assumptions)),  # Remove duplicates, service-specific ones first
+        "disclaimers": list(COST_DISCLAIMERS)
     }
 
 def estimate_service_usage(service, analysis_result):
@@ -400,47 +576,27 @@ def estimate_service_usage(service, analysis_result):
     Returns:
         dict: Containing usage estimates
     """
-    # Default usage estimates
-    default_estimates = {
-        "ec2": {"count": 1, "hours": 730},
-        "rds": {"count": 1, "hours": 730, "size_gb": 20},
-        "s3": {"size_gb": 100, "requests": 100000},
-        "lambda": {"invocations": 1000000, "avg_duration_ms": 500, "memory_mb": 128},
-        "dynamodb": {"size_gb": 10, "rcu": 5, "wcu": 5, "requests": 300000},
-        "cloudfront": {"data_gb": 100, "requests": 1000000},
-        "eks": {"clusters": 1, "nodes": 3},
-        "ecs": {"tasks": 3},
-        "sqs": {"requests": 1000000},
-        "sns": {"requests": 1000000},
-        "cloudwatch": {"metrics": 10, "logs_gb": 5},
-    }
-    
     service_lower = service.lower()
     
     # Try to extract more accurate usage information from the analysis text
     if service_lower in ["ec2", "rds", "elasticache"]:
         # Look for instance count
-        count_match = re.search(rf'(?i)(\d+)\s+{service}\s+instances?', analysis_result)
+        count_match = USAGE_COUNT_PATTERNS[service_lower].search(analysis_result)
         if count_match:
             count = int(count_match.group(1))
             return {"count": count, "hours": 730}
     
     elif service_lower == "s3":
         # Look for storage size
-        size_match = re.search(r'(\d+)\s*(GB|TB|PB)\s+(?:of\s+)?(?:S3|storage)', analysis_result, re.IGNORECASE)
+        size_match = S3_SIZE_PATTERN.search(analysis_result)
         if size_match:
-            size = float(size_match.group(1))
-            unit = size_match.group(2).upper()
-            if unit == "TB":
-                size *= 1000
-            elif unit == "PB":
-                size *= 1000000
+            size = float(size_match.group(1)) * STORAGE_UNIT_GB[size_match.group(2).upper()]
             return {"size_gb": size, "requests": 100000}
     
     elif service_lower == "lambda":
         # Look for invocation count and memory
-        invocation_match = re.search(r'(\d+)\s+(?:lambda\s+)?invocations', analysis_result, re.IGNORECASE)
-        memory_match = re.search(r'lambda.*?(\d+)\s*MB', analysis_result, re.IGNORECASE)
+        invocation_match = LAMBDA_INVOCATIONS_PATTERN.search(analysis_result)
+        memory_match = LAMBDA_MEMORY_PATTERN.search(analysis_result)
         
         invocations = int(invocation_match.group(1)) if invocation_match else 1000000
         memory_mb = int(memory_match.group(1)) if memory_match else 128
@@ -448,19 +604,48 @@ def estimate_service_usage(service, analysis_result):
         return {"invocations": invocations, "avg_duration_ms": 500, "memory_mb": memory_mb}
     
     # Return default estimates if service exists in defaults, otherwise return generic count
-    return default_estimates.get(service_lower, {"count": 1})
+    # Copy so callers never share the module-level defaults
+    return dict(DEFAULT_USAGE_ESTIMATES.get(service_lower, {"count": 1}))
 
-def query_bedrock_with_retry(prompt, retries=None):
+def query_bedrock_with_retry(prompt, retries=None, kind=None):
     """
     Query Amazon Bedrock with a prompt and retry on failure
     """
+    # Serialize once up front rather than on every attempt
+    body = encode_prompt(prompt)
+    
+    # Reprocessing the same document produces byte-identical prompts; answer those from memory
+    response_key = hashlib.blake2b(body, digest_size=16).digest()
+    response_text = get_bedrock_response_from_memory(response_key)
+    if response_text is not None:
+        logger.info("Using cached Bedrock response")
+        return response_text
+    
+    response_body = invoke_bedrock_with_retry(body, retries, kind)
+    
+    # A truncated analysis drops services from detection and pricing, so if an adaptively
+    # lowered limit cut the completion short, ask again once at the full limit
+    ceiling = MAX_TOKENS_CEILINGS.get(kind)
+    if response_body.get('stop_reason') == 'max_tokens' and ceiling and prompt['max_tokens'] < ceiling:
+        logger.info(f"Bedrock {kind} response hit max_tokens={prompt['max_tokens']}; retrying with {ceiling}")
+        response_body = invoke_bedrock_with_retry(encode_prompt({**prompt, "max_tokens": ceiling}), retries, kind)
+    
+    response_text = response_body['content'][0]['text']
+    if response_body.get('stop_reason') != 'max_tokens':
+        remember_bedrock_response(response_key, response_text)
+    return response_text
+
+def invoke_bedrock_with_retry(body, retries=None, kind=None):
+    """
+    Send an encoded request body to Amazon Bedrock, retrying on failure, and return the parsed response
+    """
     if retries is None:
         retries = MAX_RETRIES
         
     last_exception = None
     for attempt in range(retries):
         try:
-            return query_bedrock(prompt)
+            return invoke_bedrock(body, kind)
         except Exception as e:
             last_exception = e
             logger.warning(f"Bedrock query failed (attempt {attempt+1}/{retries}): {str(e)}")
@@ -470,17 +655,78 @@ def query_bedrock_with_retry(prompt, retries=None):
     logger.error(f"All Bedrock query attempts failed: {str(last_exception)}")
     raise last_exception
 
-def query_bedrock(prompt):
+def adaptive_max_tokens(kind):
     """
-    Query Amazon Bedrock with a prompt
+    Size max_tokens from recent completion lengths for this kind of prompt, never above its ceiling
+    """
+    ceiling = MAX_TOKENS_CEILINGS[kind]
+    lengths = _completion_tokens.get(kind)
+    if not lengths or len(lengths) < ADAPTIVE_MAX_TOKENS_MIN_SAMPLES:
+        return ceiling
+    p95 = statistics.quantiles(lengths, n=20)[-1]
+    return int(min(ceiling, max(ADAPTIVE_MAX_TOKENS_FLOOR, p95 * 1.2)))
+
+def record_completion_tokens(kind, response_body):
+    """
+    Record how many tokens a completion used so later prompts of the same kind can size max_tokens
+    """
+    if response_body.get('stop_reason') == 'max_tokens':
+        # The limit was too tight; go back to the full ceiling until there is fresh history
+        _completion_tokens.pop(kind, None)
+        return
+    output_tokens = response_body.get('usage', {}).get('output_tokens')
+    if output_tokens:
+        _completion_tokens.setdefault(kind, deque(maxlen=200)).append(output_tokens)
+
+def get_bedrock_response_from_memory(response_key):
+    """
+    Return a Bedrock response cached in this container's memory, or None if missing or expired
+    """
+    with _bedrock_response_lock:
+        entry = _bedrock_response_cache.get(response_key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] >= BEDROCK_RESPONSE_CACHE_TTL:
+            del _bedrock_response_cache[response_key]
+            return None
+        _bedrock_response_cache.move_to_end(response_key)
+        return entry[1]
+
+def remember_bedrock_response(response_key, response_text):
+    """
+    Keep a Bedrock response in this container's memory, evicting the least recently used entries
+    """
+    if BEDROCK_RESPONSE_CACHE_SIZE <= 0:
+        return
+    with _bedrock_response_lock:
+        _bedrock_response_cache[response_key] = (time.time(), response_text)
+        _bedrock_response_cache.move_to_end(response_key)
+        while len(_bedrock_response_cache) > BEDROCK_RESPONSE_CACHE_SIZE:
+            _bedrock_response_cache.popitem(last=False)
+
+def encode_prompt(prompt):
+    """
+    Serialize a prompt dict to the request body bytes Bedrock expects
+    """
+    if orjson:
+        return orjson.dumps(prompt)
+    return json.dumps(prompt).encode('utf-8')
+
+def invoke_bedrock(body, kind=None):
+    """
+    Send an encoded request body to Amazon Bedrock and return the parsed response
     """
     try:
-        response = bedrock.invoke_model(
+        response = get_client('bedrock-runtime').invoke_model(
             modelId=BEDROCK_MODEL_ID,
-            body=json.dumps(prompt)
+            body=body
         )
-        response_body = json.loads(response['body'].read())
-        return response_body['content'][0]['text']
+        raw = response['body'].read()
+        response_body = orjson.loads(raw) if orjson else json.loads(raw)
+        response_body['content'][0]['text']  # Fail (and retry) here on a malformed response
+        if kind:
+            record_completion_tokens(kind, response_body)
+        return response_body
     except Exception as e:
         logger.error(f"Error querying Bedrock: {str(e)}")
         raise
@@ -489,9 +735,37 @@ def get_services_from_analysis(analysis):
     """
     Extract AWS service names from the analysis text
     """
-    services = re.findall(SERVICE_REGEX, analysis, re.IGNORECASE)
-    services = [s.lower() for s in services]
-    return list(set(services))
+    if SERVICE_AUTOMATON is None:
+        return unique_by_service_code({s.lower() for s in SERVICE_PATTERN.findall(analysis)})
+    
+    lowered = analysis.lower()
+    length = len(lowered)
+    services = set()
+    # Bind per-match lookups locally; this loop runs once per candidate hit in the text
+    add = services.add
+    for end, name in SERVICE_AUTOMATON.iter(lowered):
+        # Keep the regex's \b semantics: the match must not touch other word characters
+        start = end - len(name) + 1
+        if start > 0:
+            before = lowered[start - 1]
+            if before.isalnum() or before == '_':
+                continue
+        if end + 1 < length:
+            after = lowered[end + 1]
+            if after.isalnum() or after == '_':
+                continue
+        add(name)
+    return unique_by_service_code(services)
+
+def unique_by_service_code(services):
+    """
+    Keep one name per pricing service code so aliases like ELB/ALB/NLB are only priced once
+    """
+    by_code = {}
+    # Sort so the name kept for each code doesn't depend on set ordering
+    for service in sorted(services):
+        by_code.setdefault(map_service_to_code(service) or service, service)
+    return list(by_code.values())
 
 def map_service_to_code(service):
     """
@@ -499,43 +773,65 @@ def map_service_to_code(service):
     """
     return SERVICE_MAPPING.get(service.lower())
 
-def get_resource_config(service, analysis):
+# Bounded gap between keywords; unbounded .*? backtracks badly on long analysis text
+RESOURCE_CONFIG_GAP = rf'[^\n]{{0,{RESOURCE_CONFIG_WINDOW}}}?'
+
+@lru_cache(maxsize=None)
+def get_resource_config_patterns(service):
     """
-    Extract resource configuration for a service from the analysis
+    Compile the mention and configuration patterns for a service once per container
     """
+    gap = RESOURCE_CONFIG_GAP
+    
     service_patterns = {
         "ec2": [
-            rf'(?i){service}.*?(?:instance|type).*?([a-z][0-9][a-z]?\.(?:nano|micro|small|medium|large|xlarge|[0-9]+xlarge))',
-            rf'(?i)(?:instance|type).*?([a-z][0-9][a-z]?\.(?:nano|micro|small|medium|large|xlarge|[0-9]+xlarge)).*?{service}'
+            rf'{service}{gap}(?:instance|type){gap}([a-z][0-9][a-z]?\.(?:nano|micro|small|medium|large|xlarge|[0-9]+xlarge))',
+            rf'(?:instance|type){gap}([a-z][0-9][a-z]?\.(?:nano|micro|small|medium|large|xlarge|[0-9]+xlarge)){gap}{service}'
         ],
         "rds": [
-            rf'(?i){service}.*?(?:instance|type|db).*?([a-z][0-9][a-z]?\.(?:nano|micro|small|medium|large|xlarge|[0-9]+xlarge))',
-            rf'(?i){service}.*?(?:engine).*?(mysql|postgres|aurora|oracle|sqlserver)'
+            rf'{service}{gap}(?:instance|type|db){gap}([a-z][0-9][a-z]?\.(?:nano|micro|small|medium|large|xlarge|[0-9]+xlarge))',
+            rf'{service}{gap}(?:engine){gap}(mysql|postgres|aurora|oracle|sqlserver)'
         ],
         "s3": [
-            rf'(?i){service}.*?(?:storage class|tier).*?(standard|intelligent|infrequent access|glacier|deep archive)',
-            rf'(?i){service}.*?(?:size|capacity).*?([0-9]+\s*(?:GB|TB|PB))'
+            rf'{service}{gap}(?:storage class|tier){gap}(standard|intelligent|infrequent access|glacier|deep archive)',
+            rf'{service}{gap}(?:size|capacity){gap}([0-9]+\s*(?:GB|TB|PB))'
         ],
         "lambda": [
-            rf'(?i){service}.*?(?:memory).*?([0-9]+\s*(?:MB|GB))',
-            rf'(?i){service}.*?(?:timeout).*?([0-9]+\s*(?:seconds|minutes))'
+            rf'{service}{gap}(?:memory){gap}([0-9]+\s*(?:MB|GB))',
+            rf'{service}{gap}(?:timeout){gap}([0-9]+\s*(?:seconds|minutes))'
         ],
         "dynamodb": [
-            rf'(?i){service}.*?(?:capacity|mode).*?(provisioned|on-demand)',
-            rf'(?i){service}.*?(?:RCU|WCU).*?([0-9]+)'
+            rf'{service}{gap}(?:capacity|mode){gap}(provisioned|on-demand)',
+            rf'{service}{gap}(?:RCU|WCU){gap}([0-9]+)'
         ]
     }
     
     # Get patterns for this service or use default pattern
     patterns = service_patterns.get(service.lower(), [
-        rf'(?i){service}.*?(?:instance|type|configuration|size).*?([a-z0-9\.\-]+)'
+        rf'{service}{gap}(?:instance|type|configuration|size){gap}([a-z0-9\.\-]+)'
     ])
     
+    mention_pattern = re.compile(re.escape(service), re.IGNORECASE)
+    return mention_pattern, tuple(re.compile(pattern, re.IGNORECASE) for pattern in patterns)
+
+def get_resource_config(service, analysis):
+    """
+    Extract resource configuration for a service from the analysis
+    """
+    mention_pattern, patterns = get_resource_config_patterns(service)
+    
+    # Only search the text surrounding each mention of the service instead of the whole analysis
+    windows = [
+        analysis[max(0, mention.start() - RESOURCE_CONFIG_WINDOW):mention.end() + RESOURCE_CONFIG_WINDOW]
+        for mention in mention_pattern.finditer(analysis)
+    ]
+    
     # Try each pattern
     for pattern in patterns:
-        match = re.search(pattern, analysis)
-        if match:
-            return match.group(1).strip()
+        for window in windows:
+            match = pattern.search(window)
+            if match:
+                return match.group(1).strip()
     
     return "standard"  # Default configuration
 
@@ -569,17 +865,9 @@ def build_pricing_filters(service_code, resource_config):
             }
         ]
     elif service_code == 'AmazonS3':
-        storage_class = 'General Purpose'
-        if resource_config and any(term in resource_config.lower() for term in ['standard', 'intelligent', 'infrequent', 'glacier', 'archive']):
-            if 'intelligent' in resource_config.lower():
-                storage_class = 'Intelligent-Tiering'
-            elif 'infrequent' in resource_config.lower():
-                storage_class = 'Standard - Infrequent Access'
-            elif 'glacier' in resource_config.lower():
-                storage_class = 'Glacier'
-            elif 'deep archive' in resource_config.lower():
-                storage_class = 'Glacier Deep Archive'
-                
+        config = resource_config.lower() if resource_config else ''
+        storage_class = next((name for term, name in S3_STORAGE_CLASSES if term in config), 'General Purpose')
+        
         filters['Filters'] = [
             {
                 'Type': 'TERM_MATCH',
@@ -623,48 +911,217 @@ def build_pricing_filters(service_code, resource_config):
     
     return filters
 
-from decimal import Decimal
+def get_pricing_for_services(services, analysis_result):
+    """
+    Get pricing for each service, looking up each distinct set of filters only once
+    """
+    # Services that resolve to identical filters (e.g. default EC2 configs) share a cache key
+    filters_by_key = {}
+    services_by_key = {}
+    for service in services:
+        service_code = map_service_to_code(service)
+        if service_code:
+            resource_config = get_resource_config(service, analysis_result)
+            filters = build_pricing_filters(service_code, resource_config)
+            cache_key = build_cache_key(filters)
+            filters_by_key[cache_key] = filters
+            services_by_key.setdefault(cache_key, []).append(service)
+    
+    pricing_by_key = get_pricing_batch(filters_by_key)
+    
+    pricing_data = {}
+    for cache_key, key_services in services_by_key.items():
+        for service in key_services:
+            pricing_data[service] = pricing_by_key[cache_key]
+    
+    return pricing_data
 
-def get_pricing_with_cache(filters):
+def build_cache_key(filters):
     """
-    Get pricing information with caching support
+    Build a deterministic cache key from pricing filters
     """
-    if not pricing_cache_table:
-        return get_pricing(filters)
-        
-    # Create a cache key from the filters
-    cache_key = json.dumps(filters, sort_keys=True)
+    if orjson:
+        return orjson.dumps(filters, option=orjson.OPT_SORT_KEYS).decode()
+    # Match orjson's compact output so keys are identical whichever serializer is available
+    return json.dumps(filters, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def get_pricing_batch(filters_by_key):
+    """
+    Get pricing for several filter sets, reading and writing the cache table in batches
+    """
+    results = {}
+    pending = {}
+    # One clock reading for every expiry check in this batch
+    now = time.time()
+    
+    # Serve repeat lookups from this container's memory before going to the network
+    for cache_key, filters in filters_by_key.items():
+        # Invalid filters can never be priced, so don't spend cache or API calls on them
+        if not validate_filters(filters):
+            results[cache_key] = {"error": "Invalid pricing filters"}
+            continue
+        pricing_data = get_pricing_from_memory(cache_key, now)
+        if pricing_data is None:
+            pending[cache_key] = filters
+        else:
+            results[cache_key] = pricing_data
+    
+    if pending and _pricing_cache_table_name:
+        for cache_key, (pricing_data, timestamp) in read_cached_pricing(list(pending), now).items():
+            remember_pricing(cache_key, pricing_data, timestamp)
+            results[cache_key] = pricing_data
+            del pending[cache_key]
+    
+    # If not in cache or expired, get fresh data; the Price List calls are independent round-trips
+    if len(pending) > 1:
+        with ThreadPoolExecutor(max_workers=min(PRICING_MAX_WORKERS, len(pending))) as executor:
+            fresh = dict(zip(pending, executor.map(get_pricing, pending.values())))
+    else:
+        fresh = {cache_key: get_pricing(filters) for cache_key, filters in pending.items()}
+    results.update(fresh)
+    # Only cache real results; an error (e.g. throttling) or an empty list would be served for the whole TTL
+    cacheable = {cache_key: pricing_data for cache_key, pricing_data in fresh.items()
+                 if type(pricing_data) is list and pricing_data}
+    # Stamp everything fetched in this batch with the same time in both cache tiers
+    stored_at = time.time()
+    for cache_key, pricing_data in cacheable.items():
+        remember_pricing(cache_key, pricing_data, stored_at)
+    
+    if cacheable and _pricing_cache_table_name:
+        write_cached_pricing(cacheable, stored_at)
+    
+    return results
+
+def read_cached_pricing(cache_keys, now=None):
+    """
+    Read unexpired pricing entries from the cache table with BatchGetItem
+    """
+    table_name = _pricing_cache_table_name
+    # Talk to the low-level client directly; the Resource layer adds marshaling overhead per call
+    dynamodb = get_pricing_cache_client()
+    found = {}
+    if now is None:
+        now = time.time()
     
     try:
-        # Try to get from cache
-        response = pricing_cache_table.get_item(Key={'cache_key': cache_key})
-        
-        if 'Item' in response:
-            item = response['Item']
-            # Check if cache is still valid
-            if time.time() - item['timestamp'] < PRICING_CACHE_TTL:
-                logger.info("Using cached pricing data")
-                return item['pricing_data']
+        # BatchGetItem accepts at most 100 keys per request
+        for i in range(0, len(cache_keys), 100):
+            request = {table_name: {'Keys': [{'cache_key': {'S': key}} for key in cache_keys[i:i + 100]]}}
+            for attempt in range(MAX_RETRIES):
+                response = dynamodb.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(table_name, []):
+                    # Check if cache is still valid
+                    timestamp = float(item['timestamp']['N'])
+                    if now - timestamp < PRICING_CACHE_TTL:
+                        found[item['cache_key']['S']] = (decode_cached_pricing(item['pricing_data']), timestamp)
+                # Throttled keys come back unprocessed; anything still left after the retries is a miss
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+                if attempt < MAX_RETRIES - 1:
+                    time.sleep(CACHE_RETRY_DELAY * (2 ** attempt))  # Exponential backoff
+            if request:
+                skipped = [key['cache_key']['S'] for key in request[table_name]['Keys']]
+                logger.warning(f"Pricing cache reads still unprocessed after {MAX_RETRIES} attempts: {skipped}")
     except Exception as e:
         logger.warning(f"Error accessing pricing cache: {str(e)}")
     
-    # If not in cache or expired, get fresh data
-    pricing_data = get_pricing(filters)
+    if found:
+        logger.info(f"Using cached pricing data for {len(found)} of {len(cache_keys)} lookups")
+    return found
+
+def write_cached_pricing(pricing_by_key, now=None):
+    """
+    Store pricing entries in the cache table with BatchWriteItem
+    """
+    table_name = _pricing_cache_table_name
+    dynamodb = get_pricing_cache_client()
+    if now is None:
+        now = time.time()
+    timestamp = str(now)
+    # DynamoDB TTL deletes entries lazily, so readers still check the timestamp
+    expires_at = str(int(now) + PRICING_CACHE_TTL)
+    requests = [
+        {'PutRequest': {'Item': {
+            'cache_key': {'S': cache_key},
+            'pricing_data': encode_cached_pricing(pricing_data),
+            'timestamp': {'N': timestamp},
+            'expires_at': {'N': expires_at}
+        }}}
+        for cache_key, pricing_data in pricing_by_key.items()
+    ]
     
-    # Store in cache
     try:
-        # Convert timestamp to Decimal for DynamoDB compatibility
-        pricing_cache_table.put_item(
-            Item={
-                'cache_key': cache_key,
-                'pricing_data': pricing_data,
-                'timestamp': Decimal(str(time.time()))  # Convert float to Decimal
-            }
-        )
+        # BatchWriteItem accepts at most 25 items per request
+        for i in range(0, len(requests), 25):
+            request = {table_name: requests[i:i + 25]}
+            for attempt in range(MAX_RETRIES):
+                response = dynamodb.batch_write_item(RequestItems=request)
+                request = response.get('UnprocessedItems')
+                if not request:
+                    break
+                if attempt < MAX_RETRIES - 1:
+                    time.sleep(CACHE_RETRY_DELAY * (2 ** attempt))  # Exponential backoff
+            if request:
+                skipped = [item['PutRequest']['Item']['cache_key']['S'] for item in request[table_name]]
+                logger.warning(f"Pricing cache writes still unprocessed after {MAX_RETRIES} attempts: {skipped}")
     except Exception as e:
         logger.warning(f"Error storing in pricing cache: {str(e)}")
-    
-    return pricing_data
+
+def encode_cached_pricing(pricing_data):
+    """
+    Encode pricing as a single binary JSON attribute for the cache table
+    """
+    # One C-level dump is far cheaper than marshaling every nested value into DynamoDB's typed format
+    if orjson:
+        return {'B': orjson.dumps(pricing_data)}
+    return {'B': json.dumps(pricing_data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')}
+
+def decode_cached_pricing(attribute):
+    """
+    Decode a cached pricing attribute written by encode_cached_pricing
+    """
+    return orjson.loads(attribute['B']) if orjson else json.loads(attribute['B'])
+
+def get_pricing_from_memory(cache_key, now=None):
+    """
+    Return pricing cached in this container's memory, or None if missing or expired
+    """
+    with _pricing_memory_lock:
+        entry = _pricing_memory_cache.get(cache_key)
+        if entry is None:
+            return None
+        if (time.time() if now is None else now) - entry[0] >= PRICING_CACHE_TTL:
+            del _pricing_memory_cache[cache_key]
+            return None
+        _pricing_memory_cache.move_to_end(cache_key)
+        return entry[1]
+
+def remember_pricing(cache_key, pricing_data, stored_at=None):
+    """
+    Keep pricing in this container's memory, evicting the least recently used entries
+    """
+    with _pricing_memory_lock:
+        _pricing_memory_cache[cache_key] = (time.time() if stored_at is None else stored_at, pricing_data)
+        _pricing_memory_cache.move_to_end(cache_key)
+        while len(_pricing_memory_cache) > PRICING_MEMORY_CACHE_SIZE:
+            _pricing_memory_cache.popitem(last=False)
+
+@lru_cache(maxsize=None)
+def get_pricing_cache_client():
+    """
+    Return the client used for the pricing cache table, going through DAX when an endpoint is configured
+    """
+    if DAX_ENDPOINT:
+        try:
+            import amazondax
+            return amazondax.AmazonDaxClient(endpoint_url=DAX_ENDPOINT)
+        except ImportError:
+            logger.warning("amazondax is not installed; using DynamoDB directly for the pricing cache")
+        except Exception as e:
+            # Cluster discovery runs here; the cache is optional, so fall back rather than fail the request
+            logger.warning(f"Error connecting to DAX at {DAX_ENDPOINT}; using DynamoDB directly for the pricing cache: {str(e)}")
+    return get_client('dynamodb')
 
 
 def get_pricing(filters):
@@ -675,35 +1132,31 @@ def get_pricing(filters):
         if not validate_filters(filters):
             return {"error": "Invalid pricing filters"}
             
+        pricing = get_client('pricing')
         pricing_data = []
-        next_token = None
+        # Ask for the largest page the API allows so fewer round-trips are needed
+        request = {
+            'ServiceCode': filters.get('ServiceCode'),
+            'Filters': filters.get('Filters', []),
+            'MaxResults': 100
+        }
         
         # Use pagination to get all results
         for i in range(5):  # Limit to 5 pages to avoid excessive API calls
-            if next_token:
-                pricing_response = pricing.get_products(
-                    ServiceCode=filters.get('ServiceCode'),
-                    Filters=filters.get('Filters', []),
-                    NextToken=next_token
-                )
-            else:
-                pricing_response = pricing.get_products(
-                    ServiceCode=filters.get('ServiceCode'),
-                    Filters=filters.get('Filters', [])
-                )
+            pricing_response = pricing.get_products(**request)
             
             # Process this page of results
             pricing_data.extend(process_pricing_response(pricing_response))
             
             # Check if there are more results
             if 'NextToken' in pricing_response:
-                next_token = pricing_response['NextToken']
+                request['NextToken'] = pricing_response['NextToken']
             else:
                 break
         
         return pricing_data
     except Exception as e:
-        logger.error(f"Error getting pricing: {str(e)}", exc_info=True)
+        logger.exception(f"Error getting pricing: {str(e)}")
         return {"error": str(e)}
 
 def validate_filters(filters):
@@ -724,13 +1177,15 @@ def process_pricing_response(response):
         products = []
         for price_item in response.get('PriceList', []):
             if isinstance(price_item, str):
-                product = json.loads(price_item)
+                product = orjson.loads(price_item) if orjson else json.loads(price_item)
+                
+                product_info = product.get('product', {})
                 
                 # Extract the most relevant pricing information
                 simplified_product = {
-                    'sku': product.get('product', {}).get('sku'),
-                    'productFamily': product.get('product', {}).get('productFamily'),
-                    'attributes': extract_important_attributes(product.get('product', {}).get('attributes', {})),
+                    'sku': product_info.get('sku'),
+                    'productFamily': product_info.get('productFamily'),
+                    'attributes': extract_important_attributes(product_info.get('attributes', {})),
                     'pricing': extract_simplified_pricing(product.get('terms', {}))
                 }
                 
@@ -739,7 +1194,7 @@ def process_pricing_response(response):
         # Return a simplified version with just the first few products
         return products[:5] if products else []
     except Exception as e:
-        logger.error(f"Error processing pricing response: {str(e)}", exc_info=True)
+        logger.exception(f"Error processing pricing response: {str(e)}")
         return []
 
 def extract_important_attributes(attributes):
@@ -754,175 +1209,203 @@ def extract_important_attributes(attributes):
     
     return {k: v for k, v in attributes.items() if k in important_keys}
 
+# Price List term types to keep, and the key each is stored under
+PRICING_TERM_TYPES = (('OnDemand', 'onDemand'), ('Reserved', 'reserved'))
+
+def _first(mapping):
+    """
+    Return the first value of a dict without materializing all of its values
+    """
+    return next(iter(mapping.values()))
+
 def extract_simplified_pricing(terms):
     """
     Extract simplified pricing information from the terms
     """
     pricing = {}
     
-    # On-Demand pricing
-    if 'OnDemand' in terms:
-        on_demand = list(terms['OnDemand'].values())[0]
-        price_dimensions = list(on_demand['priceDimensions'].values())[0]
-        
-        pricing['onDemand'] = {
-            'unit': price_dimensions.get('unit', ''),
-            'pricePerUnit': price_dimensions.get('pricePerUnit', {}),
-            'description': price_dimensions.get('description', '')
-        }
-    
-    # Reserved pricing (simplified)
-    if 'Reserved' in terms:
-        reserved = list(terms['Reserved'].values())[0]
-        price_dimensions = list(reserved['priceDimensions'].values())[0]
-        
-        pricing['reserved'] = {
-            'unit': price_dimensions.get('unit', ''),
-            'pricePerUnit': price_dimensions.get('pricePerUnit', {}),
-            'description': price_dimensions.get('description', '')
-        }
+    # On-Demand and (simplified) Reserved pricing share the same shape
+    for term_type, key in PRICING_TERM_TYPES:
+        offers = terms.get(term_type)
+        if offers:
+            price_dimensions = _first(_first(offers)['priceDimensions'])
+            pricing[key] = {
+                'unit': price_dimensions.get('unit', ''),
+                'pricePerUnit': price_dimensions.get('pricePerUnit', {}),
+                'description': price_dimensions.get('description', '')
+            }
     
     return pricing
 
+def select_price_option(prices):
+    """
+    Pick the option a service is priced with, as (price_option, on_demand, unit_price), or None
+    """
+    selected = None
+    for price in prices:
+        on_demand = (price.get('pricing') or {}).get('onDemand')
+        if not on_demand:
+            continue
+        try:
+            unit_price = float((on_demand.get('pricePerUnit') or {}).get('USD'))
+        except (ValueError, TypeError):
+            continue
+        # Prefer the lowest non-zero price so free-tier rows don't hide the real rate
+        key = (unit_price == 0, unit_price)
+        if selected is None or key < selected[0]:
+            selected = (key, price, on_demand, unit_price)
+    return selected[1:] if selected else None
+
+def summarize_pricing(pricing_data):
+    """
+    Summarize pricing data as one line per service using the cheapest on-demand option
+    """
+    if not pricing_data:
+        return ""
+    
+    lines = ["Pricing Information:"]
+    append = lines.append
+    for service, prices in pricing_data.items():
+        name = service.upper()
+        # get_pricing only ever produces plain lists (results) or dicts (errors)
+        if type(prices) is list and prices:
+            selected = select_price_option(prices)
+            if selected is None:
+                append(f"{name}: No on-demand pricing available")
+                continue
+            
+            price_option, on_demand, _ = selected
+            line = f"{name}: {on_demand['pricePerUnit']['USD']} USD per {on_demand.get('unit') or 'unit'}"
+            attributes = price_option.get('attributes')
+            if attributes:
+                details = ", ".join(f"{k}: {v}" for k, v in attributes.items() if k in COST_ATTRIBUTE_KEYS)
+                if details:
+                    line += f" ({details})"
+            append(line)
+        elif type(prices) is dict and 'error' in prices:
+            append(f"{name}: Error retrieving pricing: {prices['error']}")
+    
+    # Don't send a bare section header when no service produced a line
+    return "\n".join(lines) if len(lines) > 1 else ""
+
+def fit_to_budget(sections, budget):
+    """
+    Trim each section in proportion to its length so their combined length fits the budget
+    """
+    total = sum(len(section) for section in sections)
+    if total <= budget:
+        return sections
+    logger.info(f"Truncating prompt sections from {total} to {budget} characters")
+    return tuple(truncate_text(section, len(section) * budget // total) for section in sections)
+
+def truncate_text(text, limit):
+    """
+    Cut text to at most limit characters, marking where it was cut
+    """
+    if len(text) <= limit:
+        return text
+    return text[:max(0, limit - len(TRUNCATION_MARKER))] + TRUNCATION_MARKER
+
 def build_recommendations_prompt(analysis, pricing_data, cost_estimate=None):
     """
     Build a prompt for Bedrock to generate optimization recommendations
     """
-    # Create a simplified pricing summary
-    pricing_summary = "Pricing Information:\n"
-    for service, prices in pricing_data.items():
-        pricing_summary += f"\n{service.upper()} PRICING:\n"
-        if isinstance(prices, list) and prices:
-            for i, price in enumerate(prices[:3]):
-                pricing_summary += f"Option {i+1}:\n"
-                if 'attributes' in price:
-                    for k, v in price.get('attributes', {}).items():
-                        pricing_summary += f"  {k}: {v}\n"
-                if 'pricing' in price:
-                    pricing_info = price.get('pricing', {})
-                    if 'onDemand' in pricing_info:
-                        on_demand = pricing_info['onDemand']
-                        pricing_summary += f"  On-Demand: {on_demand.get('pricePerUnit', {}).get('USD', 'N/A')} USD per {on_demand.get('unit', 'unit')}\n"
-                    if 'reserved' in pricing_info:
-                        reserved = pricing_info['reserved']
-                        pricing_summary += f"  Reserved: {reserved.get('pricePerUnit', {}).get('USD', 'N/A')} USD per {reserved.get('unit', 'unit')}\n"
-        elif isinstance(prices, dict) and 'error' in prices:
-            pricing_summary += f"  Error retrieving pricing: {prices['error']}\n"
-    
-    # Add cost estimation summary if available
-    cost_summary = ""
-    if cost_estimate:
-        cost_summary = f"\nESTIMATED MONTHLY COST: \${cost_estimate['total_estimated_monthly_cost']:.2f} USD\n\n"
+    # Create a compact pricing summary with one line per service
+    pricing_summary = summarize_pricing(pricing_data)
+    
+    # Add cost estimation summary if there is anything to estimate
+    cost_parts = []
+    if cost_estimate and cost_estimate.get('service_costs'):
+        cost_parts.append(f"\nESTIMATED MONTHLY COST: ${cost_estimate['total_estimated_monthly_cost']:.2f} USD\n\n")
         
         # Add per-service costs
-        cost_summary += "Service Cost Breakdown:\n"
+        cost_parts.append("Service Cost Breakdown:\n")
         for service, service_cost in cost_estimate['service_costs'].items():
-            cost_summary += f"- {service}: \${service_cost['estimated_monthly_cost']:.2f} USD\n"
+            cost_parts.append(f"- {service}: ${service_cost['estimated_monthly_cost']:.2f} USD\n")
         
-        # Add assumptions
-        cost_summary += "\nAssumptions:\n"
-        for assumption in cost_estimate['assumptions'][:10]:  # Limit to top 10 assumptions
-            cost_summary += f"- {assumption}\n"
+        # Add assumptions, limited to the top 10
+        cost_parts.append("\nAssumptions:\n")
+        cost_parts.append("".join(f"- {assumption}\n" for assumption in islice(cost_estimate['assumptions'], 10)))
         
         # Add disclaimers
-        cost_summary += "\nDisclaimers:\n"
-        for disclaimer in cost_estimate['disclaimers']:
-            cost_summary += f"- {disclaimer}\n"
+        cost_parts.append("\nDisclaimers:\n")
+        cost_parts.append("".join(f"- {disclaimer}\n" for disclaimer in cost_estimate['disclaimers']))
+    cost_summary = "".join(cost_parts)
+    logger.debug(f"pricing_summary chars={len(pricing_summary)} cost_summary chars={len(cost_summary)}")
+    
+    # Keep the prompt inside a fixed budget so Bedrock latency and input cost stay bounded
+    analysis, pricing_summary, cost_summary = fit_to_budget(
+        (analysis, pricing_summary, cost_summary), RECOMMENDATIONS_CHAR_BUDGET
+    )
+    
+    # Fill the per-request block in a single substitution pass
+    content = RECOMMENDATIONS_DATA_TEMPLATE.format_map({
+        "analysis": analysis,
+        "pricing_summary": pricing_summary,
+        "cost_summary": cost_summary
+    }).rstrip()
     
     prompt = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 2000,
+        "anthropic_version": BEDROCK_ANTHROPIC_VERSION,
+        "max_tokens": adaptive_max_tokens('recommendations'),
         "messages": [
             {
                 "role": "user",
-                "content": f"""Based on the following infrastructure analysis, pricing information, and cost estimates, 
-provide detailed optimization recommendations to improve cost efficiency, performance, security, and reliability.
-
-Infrastructure Analysis:
-{analysis}
-
-{pricing_summary}
-
-{cost_summary}
-
-Please provide specific, actionable recommendations in these categories:
-1. Cost optimization - Include specific instance right-sizing, reserved instances, savings plans, and storage optimizations
-2. Performance improvements - Suggest architecture changes to improve performance
-3. Security enhancements - Identify potential security issues and recommend solutions
-4. Reliability and high availability - Recommend changes to improve system reliability
-5. Architecture best practices - Suggest AWS Well-Architected Framework improvements
-
-For each recommendation, explain:
-- The specific issue or opportunity
-- The recommended change with specific AWS services or configurations
-- The expected benefit (quantify if possible)
-- Implementation approach and complexity (low, medium, high)
-
-Include a section at the beginning with a summary of the estimated monthly cost and key cost-saving opportunities."""
+                "content": [
+                    RECOMMENDATIONS_INSTRUCTIONS_BLOCK,
+                    {
+                        "type": "text",
+                        "text": content
+                    }
+                ]
             }
         ]
     }
     return prompt
 
 
-def ensure_pricing_cache_table_exists():
+def ensure_resources_exist():
     """
-    Ensure the pricing cache DynamoDB table exists, creating it if necessary
+    Ensure the pricing cache table and output bucket exist, checking both concurrently on cold start
     """
-    table_name = os.environ.get('PRICING_CACHE_TABLE', 'PricingCache')
+    global _resources_checked
+    if _resources_checked:
+        return
     
-    try:
-        # Check if table exists
-        dynamodb.meta.client.describe_table(TableName=table_name)
-        logger.info(f"DynamoDB table {table_name} already exists")
-        return dynamodb.Table(table_name)
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'ResourceNotFoundException':
-            logger.info(f"Creating DynamoDB table {table_name}")
-            
-            # Create the table
-            table = dynamodb.create_table(
-                TableName=table_name,
-                KeySchema=[
-                    {
-                        'AttributeName': 'cache_key',
-                        'KeyType': 'HASH'  # Partition key
-                    }
-                ],
-                AttributeDefinitions=[
-                    {
-                        'AttributeName': 'cache_key',
-                        'AttributeType': 'S'  # String
-                    }
-                ],
-                BillingMode='PAY_PER_REQUEST'  # On-demand capacity
-            )
-            
-            # Wait for table to be created
-            table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
-            logger.info(f"DynamoDB table {table_name} created successfully")
-            return table
-        else:
-            logger.error(f"Error checking DynamoDB table: {str(e)}")
-            raise
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        table_future = executor.submit(ensure_pricing_cache_table_exists)
+        bucket_future = executor.submit(ensure_output_bucket_exists)
+        
+        # The cache is optional, so pricing falls back to direct API calls without it
+        try:
+            table_future.result()
+        except Exception as e:
+            logger.warning(f"Could not initialize pricing cache table: {str(e)}")
+        bucket_future.result()
+    
+    _resources_checked = True
 
 def ensure_pricing_cache_table_exists():
     """
     Ensure the pricing cache DynamoDB table exists, creating it if necessary
     """
+    global _pricing_cache_table_name
+    if _pricing_cache_table_name is not None:
+        return _pricing_cache_table_name
+    
     table_name = os.environ.get('PRICING_CACHE_TABLE', 'PricingCache')
+    dynamodb = get_client('dynamodb')
     
     try:
         # Check if table exists
-        dynamodb.meta.client.describe_table(TableName=table_name)
+        dynamodb.describe_table(TableName=table_name)
         logger.info(f"DynamoDB table {table_name} already exists")
-        return dynamodb.Table(table_name)
     except ClientError as e:
         if e.response['Error']['Code'] == 'ResourceNotFoundException':
             logger.info(f"Creating DynamoDB table {table_name}")
             
             # Create the table
-            table = dynamodb.create_table(
+            dynamodb.create_table(
                 TableName=table_name,
                 KeySchema=[
                     {
@@ -938,21 +1421,41 @@ def ensure_pricing_cache_table_exists():
                 ],
                 BillingMode='PAY_PER_REQUEST'  # On-demand capacity
             )
-            
-            # Wait for table to be created
-            table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
-            logger.info(f"DynamoDB table {table_name} created successfully")
-            return table
+            # Don't block on the table becoming ACTIVE; cache reads and writes fail soft until it is.
+            # TTL can only be enabled on an ACTIVE table, so that waits on a thread the handler never joins.
+            threading.Thread(target=enable_pricing_cache_ttl, args=(table_name,), daemon=True).start()
         else:
             logger.error(f"Error checking DynamoDB table: {str(e)}")
             raise
+    
+    _pricing_cache_table_name = table_name
+    return table_name
 
+def enable_pricing_cache_ttl(table_name):
+    """
+    Let DynamoDB expire stale pricing entries through the expires_at attribute
+    """
+    dynamodb = get_client('dynamodb')
+    try:
+        # Only runs on a background thread after first creation, so waiting here doesn't hold up the handler
+        dynamodb.get_waiter('table_exists').wait(TableName=table_name)
+        dynamodb.update_time_to_live(
+            TableName=table_name,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+        )
+    except Exception as e:
+        logger.warning(f"Error enabling TTL on DynamoDB table {table_name}: {str(e)}")
 
 def ensure_output_bucket_exists():
     """
     Ensure the output S3 bucket exists, creating it if necessary
     """
+    global _output_bucket_verified
+    if _output_bucket_verified:
+        return
+    
     bucket_name = OUTPUT_BUCKET
+    s3 = get_client('s3')
     
     try:
         # Check if bucket exists by listing its contents
@@ -985,30 +1488,87 @@ def ensure_output_bucket_exists():
         else:
             logger.error(f"Error checking S3 bucket: {str(e)}")
             raise
+    
+    _output_bucket_verified = True
 
 
 def store_output(output):
     """
-    Store the analysis output in S3
+    Store the analysis output in S3, in the background when ASYNC_OUTPUT_UPLOAD is enabled
     """
     try:
         # Create a unique file name with timestamp
-        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        extension = ".json.gz" if COMPRESS_OUTPUT else ".json"
+        key_tail = f"analysis/{time.strftime('%Y%m%d-%H%M%S')}-{uuid4().hex}{extension}"
         
         # Combine prefix with the output key, ensuring no double slashes
-        if OUTPUT_PREFIX:
-            output_key = f"{OUTPUT_PREFIX.rstrip('/')}/analysis/{timestamp}-{str(uuid.uuid4())}.json"
-        else:
-            output_key = f"analysis/{timestamp}-{str(uuid.uuid4())}.json"
+        output_key = f"{OUTPUT_PREFIX.rstrip('/')}/{key_tail}" if OUTPUT_PREFIX else key_tail
         
-        s3.put_object(
-            Bucket=OUTPUT_BUCKET,
-            Key=output_key,
-            Body=json.dumps(output, indent=2),
-            ContentType='application/json'
-        )
+        if _upload_executor:
+            # Best effort only: an upload still running when the environment is recycled is lost
+            _pending_uploads.append(_upload_executor.submit(upload_output, output, output_key))
+        else:
+            upload_output(output, output_key)
         
         return f"s3://{OUTPUT_BUCKET}/{output_key}"
     except Exception as e:
-        logger.error(f"Error storing output: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        logger.exception(f"Error storing output: {str(e)}")
+        raise
+
+def upload_output(output, output_key):
+    """
+    Serialize the analysis output and upload it to S3 under the given key
+    """
+    buffer = io.BytesIO()
+    stream = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=OUTPUT_COMPRESS_LEVEL) if COMPRESS_OUTPUT else buffer
+    if orjson:
+        # orjson encodes the whole document in C, much faster than json.dump's chunked Python writes
+        stream.write(orjson.dumps(output, option=orjson.OPT_INDENT_2 if PRETTY_OUTPUT else 0))
+    else:
+        # Serialize straight into a byte buffer instead of building the whole document as a str first
+        writer = io.TextIOWrapper(stream, encoding='utf-8', write_through=True)
+        if PRETTY_OUTPUT:
+            json.dump(output, writer, indent=2)
+        else:
+            json.dump(output, writer, separators=(',', ':'))
+        writer.detach()  # Keep the buffer open once the wrapper goes away
+    if COMPRESS_OUTPUT:
+        stream.close()  # Writes the gzip trailer; the underlying buffer stays open
+    body = buffer.getvalue()
+    
+    extra_args = {'ContentType': 'application/json'}
+    if COMPRESS_OUTPUT:
+        extra_args['ContentEncoding'] = 'gzip'
+    
+    # Large documents go through the transfer manager so parts upload in parallel
+    if len(body) > MULTIPART_THRESHOLD:
+        buffer.seek(0)
+        get_client('s3').upload_fileobj(
+            buffer,
+            OUTPUT_BUCKET,
+            output_key,
+            ExtraArgs=extra_args,
+            Config=_transfer_config
+        )
+        return
+    
+    # Send the length and digest of the final bytes up front so the upload needn't be re-read to size or hash it
+    get_client('s3').put_object(
+        Bucket=OUTPUT_BUCKET,
+        Key=output_key,
+        Body=body,
+        ContentLength=len(body),
+        ContentMD5=base64.b64encode(hashlib.md5(body).digest()).decode('ascii'),
+        **extra_args
+    )
+
+def wait_for_pending_uploads():
+    """
+    Wait for background uploads started by earlier invocations and log any failures
+    """
+    while _pending_uploads:
+        future = _pending_uploads.pop()
+        try:
+            future.result()
+        except Exception as e:
+            logger.exception(f"Error storing output in the background: {str(e)}")